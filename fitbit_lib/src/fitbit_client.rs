@@ -1,12 +1,12 @@
 use anyhow::{format_err, Error};
 use base64::{encode, encode_config, URL_SAFE_NO_PAD};
-use chrono::{DateTime, FixedOffset, Local, NaiveDate, NaiveTime, Utc};
-use crossbeam_utils::atomic::AtomicCell;
+use chrono::{DateTime, FixedOffset, Local, NaiveDate, NaiveTime, TimeZone, Utc};
 use futures::future::try_join_all;
 use itertools::Itertools;
 use lazy_static::lazy_static;
 use log::debug;
 use maplit::hashmap;
+use parking_lot::Mutex;
 use rand::{thread_rng, Rng};
 use reqwest::{header::HeaderMap, Client, Response, Url};
 use rweb::Schema;
@@ -18,7 +18,7 @@ use std::{
     path::PathBuf,
 };
 use tokio::{
-    fs::File,
+    fs::{remove_file, rename, File, OpenOptions},
     io::{AsyncBufReadExt, AsyncWriteExt, BufReader},
     task::spawn_blocking,
     time::{sleep, Duration},
@@ -40,8 +40,21 @@ use crate::{
     scale_measurement::ScaleMeasurement,
 };
 
+/// Seconds an authorization state token stays valid
+const CSRF_TOKEN_TTL: i64 = 3600;
+
+const AUTH_SUCCESS: &str = r#"
+    <h1>You are now authorized to access the Fitbit API!</h1>
+    <br/><h3>You can close this window</h3>
+    <script language="JavaScript" type="text/javascript">window.close()</script>
+    "#;
+
 lazy_static! {
-    static ref CSRF_TOKEN: AtomicCell<Option<StackString>> = AtomicCell::new(None);
+    static ref FITBIT_CLIENT: Client = Client::builder()
+        .cookie_store(true)
+        .build()
+        .expect("Failed to build client");
+    static ref CSRF_TOKENS: Mutex<HashMap<StackString, DateTime<Utc>>> = Mutex::new(HashMap::new());
 }
 
 #[derive(Default, Debug, Clone)]
@@ -84,7 +97,7 @@ impl FitbitClient {
     pub async fn from_file(config: GarminConfig) -> Result<Self, Error> {
         let mut client = Self {
             config,
-            client: Client::builder().cookie_store(true).build()?,
+            client: FITBIT_CLIENT.clone(),
             ..Self::default()
         };
         let f = File::open(&client.config.fitbit_tokenfile).await?;
@@ -95,15 +108,13 @@ impl FitbitClient {
             if b.read_line(&mut line).await? == 0 {
                 break;
             }
-            let mut items = line.split('=');
-            if let Some(key) = items.next() {
-                if let Some(val) = items.next() {
-                    match key {
-                        "user_id" => client.user_id = val.trim().into(),
-                        "access_token" => client.access_token = val.trim().into(),
-                        "refresh_token" => client.refresh_token = val.trim().into(),
-                        _ => {}
-                    }
+            if let Some((key, val)) = line.split_once('=') {
+                let val = val.trim();
+                match key.trim().to_ascii_lowercase().as_str() {
+                    "user_id" => client.user_id = val.into(),
+                    "access_token" => client.access_token = val.into(),
+                    "refresh_token" => client.refresh_token = val.into(),
+                    _ => {}
                 }
             }
         }
@@ -111,14 +122,36 @@ impl FitbitClient {
     }
 
     pub async fn to_file(&self) -> Result<(), Error> {
-        let mut f = tokio::fs::File::create(&self.config.fitbit_tokenfile).await?;
-        f.write_all(format!("user_id={}\n", self.user_id).as_bytes())
+        let tokenfile = &self.config.fitbit_tokenfile;
+        let fname = tokenfile
+            .file_name()
+            .ok_or_else(|| format_err!("Bad tokenfile {:?}", tokenfile))?
+            .to_string_lossy();
+        let tmp_file =
+            tokenfile.with_file_name(format!(".{}.{}.tmp", fname, Self::get_random_string()));
+        let mut f = OpenOptions::new()
+            .write(true)
+            .create_new(true)
+            .mode(0o600)
+            .open(&tmp_file)
             .await?;
-        f.write_all(format!("access_token={}\n", self.access_token).as_bytes())
-            .await?;
-        f.write_all(format!("refresh_token={}\n", self.refresh_token).as_bytes())
+        let result = async {
+            f.write_all(
+                format!(
+                    "user_id={}\naccess_token={}\nrefresh_token={}\n",
+                    self.user_id, self.access_token, self.refresh_token
+                )
+                .as_bytes(),
+            )
             .await?;
-        Ok(())
+            f.sync_all().await?;
+            rename(&tmp_file, tokenfile).await
+        }
+        .await;
+        if result.is_err() {
+            remove_file(&tmp_file).await.ok();
+        }
+        result.map_err(Into::into)
     }
 
     pub fn get_offset(&self) -> FixedOffset {
@@ -218,7 +251,10 @@ impl FitbitClient {
                 ("state", state.as_str()),
             ],
         )?;
-        CSRF_TOKEN.store(Some(state.into()));
+        let now = Utc::now();
+        let mut csrf_tokens = CSRF_TOKENS.lock();
+        csrf_tokens.retain(|_, created| now - *created < chrono::Duration::seconds(CSRF_TOKEN_TTL));
+        csrf_tokens.insert(state.into(), now);
         Ok(url)
     }
 
@@ -275,13 +311,7 @@ impl FitbitClient {
         self.user_id = auth_resp.user_id;
         self.access_token = auth_resp.access_token;
         self.refresh_token = auth_resp.refresh_token;
-        let success = r#"
-            <h1>You are now authorized to access the Fitbit API!</h1>
-            <br/><h3>You can close this window</h3>
-            <script language="JavaScript" type="text/javascript">window.close()</script>
-            "#
-        .into();
-        Ok(success)
+        Ok(AUTH_SUCCESS.into())
     }
 
     pub async fn get_fitbit_access_token(
@@ -289,10 +319,13 @@ impl FitbitClient {
         code: &str,
         state: &str,
     ) -> Result<StackString, Error> {
-        if let Some(current_state) = CSRF_TOKEN.swap(None) {
-            if state != current_state.as_str() {
-                return Err(format_err!("Incorrect state"));
-            }
+        let csrf_valid = CSRF_TOKENS
+            .lock()
+            .remove(&StackString::from(state))
+            .map_or(false, |created| {
+                Utc::now() - created < chrono::Duration::seconds(CSRF_TOKEN_TTL)
+            });
+        if csrf_valid {
             let headers = self.get_basic_headers()?;
             let redirect_uri = format!("https://{}/garmin/fitbit/callback", self.config.domain);
             let data = hashmap! {
@@ -321,15 +354,9 @@ impl FitbitClient {
             self.user_id = auth_resp.user_id;
             self.access_token = auth_resp.access_token;
             self.refresh_token = auth_resp.refresh_token;
-            let success = r#"
-                <h1>You are now authorized to access the Fitbit API!</h1>
-                <br/><h3>You can close this window</h3>
-                <script language="JavaScript" type="text/javascript">window.close()</script>
-                "#
-            .into();
-            Ok(success)
+            Ok(AUTH_SUCCESS.into())
         } else {
-            Err(format_err!("No state"))
+            Err(format_err!("Incorrect state"))
         }
     }
 
@@ -348,7 +375,7 @@ impl FitbitClient {
         }
         #[derive(Deserialize)]
         struct HrDataSet {
-            time: StackString,
+            time: NaiveTime,
             value: i32,
         }
 
@@ -375,8 +402,10 @@ impl FitbitClient {
             .dataset
             .into_iter()
             .map(|entry| {
-                let datetime = format!("{}T{}{}", date, entry.time, offset);
-                let datetime = DateTime::parse_from_rfc3339(&datetime)?
+                let datetime = offset
+                    .from_local_datetime(&date.and_time(entry.time))
+                    .single()
+                    .ok_or_else(|| format_err!("Invalid time {}", entry.time))?
                     .with_timezone(&Utc)
                     .into();
                 let value = entry.value;
@@ -441,9 +470,9 @@ impl FitbitClient {
             .weight
             .into_iter()
             .filter_map(|bw| {
-                let datetime = format!("{}T{}{}", bw.date, bw.time, offset);
-                let datetime = DateTime::parse_from_rfc3339(&datetime)
-                    .ok()?
+                let datetime = offset
+                    .from_local_datetime(&bw.date.and_time(bw.time))
+                    .single()?
                     .with_timezone(&Utc)
                     .into();
                 let weight = bw.weight;
@@ -465,46 +494,42 @@ impl FitbitClient {
     {
         let headers = self.get_auth_headers()?;
         let offset = self.get_offset();
+        let body_url = self
+            .config
+            .fitbit_api_endpoint
+            .as_ref()
+            .ok_or_else(|| format_err!("Bad URL"))?
+            .join("1/user/-/")?;
+        let weight_url = body_url.join("body/log/weight.json")?;
+        let fat_url = body_url.join("body/log/fat.json")?;
         let futures = updates.into_iter().map(|update| {
             let headers = headers.clone();
+            let weight_url = weight_url.clone();
+            let fat_url = fat_url.clone();
             async move {
                 let datetime = update.datetime.with_timezone(&offset);
-                let date = datetime.date().naive_local();
+                let date = datetime.date().naive_local().to_string();
                 let time = datetime.naive_local().format("%H:%M:%S").to_string();
-                let url = self
-                    .config
-                    .fitbit_api_endpoint
-                    .as_ref()
-                    .ok_or_else(|| format_err!("Bad URL"))?
-                    .join("1/user/-/")?
-                    .join("body/log/weight.json")?;
                 let data = hashmap! {
                     "weight" => update.mass.to_string(),
-                    "date" => date.to_string(),
-                    "time" => time.to_string(),
+                    "date" => date.clone(),
+                    "time" => time.clone(),
                 };
                 self.client
-                    .post(url)
+                    .post(weight_url)
                     .form(&data)
                     .headers(headers.clone())
                     .send()
                     .await?
                     .error_for_status()?;
 
-                let url = self
-                    .config
-                    .fitbit_api_endpoint
-                    .as_ref()
-                    .ok_or_else(|| format_err!("Bad URL"))?
-                    .join("1/user/-/")?
-                    .join("body/log/fat.json")?;
                 let data = hashmap! {
                     "fat" => update.fat_pct.to_string(),
-                    "date" => date.to_string(),
-                    "time" => time.to_string(),
+                    "date" => date,
+                    "time" => time,
                 };
                 self.client
-                    .post(url)
+                    .post(fat_url)
                     .form(&data)
                     .headers(headers)
                     .send()
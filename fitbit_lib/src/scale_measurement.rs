@@ -4,7 +4,6 @@ use futures::future::try_join_all;
 use log::debug;
 use maplit::hashmap;
 use postgres_query::{query, query_dyn, FromSqlRow, Parameter};
-use rayon::iter::{IntoParallelIterator, ParallelIterator};
 use rweb::Schema;
 use serde::{self, Deserialize, Serialize};
 use smallvec::SmallVec;
@@ -12,7 +11,6 @@ use stack_string::StackString;
 use std::{
     collections::{HashMap, HashSet},
     fmt,
-    sync::Arc,
 };
 
 use garmin_lib::{
@@ -384,22 +382,24 @@ impl ScaleMeasurement {
     {
         let measurement_set: HashSet<_> = ScaleMeasurement::read_from_db(pool, None, None)
             .await?
-            .into_par_iter()
+            .into_iter()
             .map(|d| d.datetime)
             .collect();
-        let measurement_set = Arc::new(measurement_set);
-        let futures = measurements.into_iter().map(|meas| {
-            let measurement_set = measurement_set.clone();
-            async move {
+        let futures = measurements
+            .into_iter()
+            .filter(|meas| {
                 if measurement_set.contains(&meas.datetime) {
                     debug!("measurement exists {:?}", meas);
+                    false
                 } else {
-                    meas.insert_into_db(pool).await?;
-                    debug!("measurement inserted {:?}", meas);
+                    true
                 }
+            })
+            .map(|meas| async move {
+                meas.insert_into_db(pool).await?;
+                debug!("measurement inserted {:?}", meas);
                 Ok(())
-            }
-        });
+            });
         let results: Result<Vec<_>, Error> = try_join_all(futures).await;
         results?;
         Ok(())
@@ -8,7 +8,8 @@ use stack_string::StackString;
 use std::{
     collections::{HashMap, HashSet},
     ffi::OsStr,
-    fs::{copy, rename},
+    fs::{copy, rename, File},
+    io::Read,
     path::{Path, PathBuf},
     sync::Arc,
 };
@@ -32,7 +33,9 @@ use garmin_lib::{
         garmin_parse_tcx::GarminParseTcx,
         garmin_parse_txt::GarminParseTxt,
     },
-    utils::garmin_util::{extract_zip_from_garmin_connect, get_file_list},
+    utils::garmin_util::{
+        detect_file_type, extract_zip_from_garmin_connect, get_file_list, FILE_HEAD_SIZE,
+    },
 };
 use garmin_reports::{
     garmin_constraints::GarminConstraints, garmin_file_report_html::file_report_html,
@@ -136,27 +139,43 @@ impl GarminCli {
         &self,
         corr_map: &HashMap<(DateTime<Utc>, i32), GarminCorrectionLap>,
     ) -> Result<Vec<GarminSummary>, Error> {
-        let pg_conn = self.get_pool();
+        let opts = self.get_opts().clone();
+        let dbset: HashSet<StackString> = match opts {
+            Some(GarminCliOptions::FileNames(_) | GarminCliOptions::All) => HashSet::new(),
+            _ => get_list_of_files_from_db("", &self.get_pool())
+                .await?
+                .into_iter()
+                .collect(),
+        };
+        let config = self.get_config().clone();
+        let stdout = self.stdout.clone();
+        let corr_map = corr_map.clone();
+        spawn_blocking(move || {
+            Self::get_summary_list_sync(opts, &dbset, &stdout, &config, &corr_map)
+        })
+        .await?
+    }
 
-        let gsum_list = match self.get_opts() {
+    fn get_summary_list_sync(
+        opts: Option<GarminCliOptions>,
+        dbset: &HashSet<StackString>,
+        stdout: &StdoutChannel<StackString>,
+        config: &GarminConfig,
+        corr_map: &HashMap<(DateTime<Utc>, i32), GarminCorrectionLap>,
+    ) -> Result<Vec<GarminSummary>, Error> {
+        let gsum_list = match opts {
             Some(GarminCliOptions::FileNames(flist)) => flist
                 .par_iter()
                 .map(|f| {
-                    self.stdout.send(format!("Process {:?}", &f));
-                    GarminSummary::process_single_gps_file(
-                        &f,
-                        &self.get_config().cache_dir,
-                        &corr_map,
-                    )
+                    stdout.send(format!("Process {:?}", &f));
+                    GarminSummary::process_single_gps_file(&f, &config.cache_dir, &corr_map)
                 })
                 .collect::<Result<Vec<_>, Error>>()?,
-            Some(GarminCliOptions::All) => GarminSummary::process_all_gps_files(
-                &self.get_config().gps_dir,
-                &self.get_config().cache_dir,
-                &corr_map,
-            )?,
+            Some(GarminCliOptions::All) => {
+                GarminSummary::process_all_gps_files(&config.gps_dir, &config.cache_dir, &corr_map)?
+            }
             _ => {
-                let cacheset: HashSet<StackString> = get_file_list(&self.get_config().cache_dir)
+                let cacheset: HashSet<StackString> = get_file_list(&config.cache_dir)
                     .into_par_iter()
                     .filter_map(|f| {
                         if f.to_string_lossy().contains("garmin_correction.avro") {
@@ -168,12 +187,7 @@ impl GarminCli {
                     })
                     .collect();
 
-                let dbset: HashSet<StackString> = get_list_of_files_from_db("", &pg_conn)
-                    .await?
-                    .into_iter()
-                    .collect();
-
-                get_file_list(&self.get_config().gps_dir)
+                get_file_list(&config.gps_dir)
                     .into_par_iter()
                     .filter_map(|f| f.file_name().map(|x| x.to_string_lossy().to_string()))
                     .filter_map(|f| {
@@ -181,17 +195,13 @@ impl GarminCli {
                         if dbset.contains(f.as_str()) && cacheset.contains(cachefile.as_str()) {
                             None
                         } else {
-                            let gps_path = self.get_config().gps_dir.join(&f);
+                            let gps_path = config.gps_dir.join(&f);
                             debug!("Process {:?}", &gps_path);
                             Some(gps_path)
                         }
                     })
                     .map(|f| {
-                        GarminSummary::process_single_gps_file(
-                            &f,
-                            &self.get_config().cache_dir,
-                            &corr_map,
-                        )
+                        GarminSummary::process_single_gps_file(&f, &config.cache_dir, &corr_map)
                     })
                     .collect::<Result<Vec<_>, Error>>()?
             }
@@ -357,7 +367,21 @@ impl GarminCli {
         }
     }
 
+    fn detect_file_type_from_path(filename: &Path) -> Result<Option<&'static str>, Error> {
+        let mut head = Vec::with_capacity(FILE_HEAD_SIZE);
+        File::open(filename)?
+            .take(FILE_HEAD_SIZE as u64)
+            .read_to_end(&mut head)?;
+        Ok(detect_file_type(&head))
+    }
+
     fn transform_file_name(filename: &Path) -> Result<PathBuf, Error> {
+        if let Some(suffix) = Self::detect_file_type_from_path(filename)? {
+            let fname = filename.with_extension(suffix);
+            rename(&filename, &fname)?;
+            return Ok(fname);
+        }
+
         macro_rules! check_filename {
             ($suffix:expr, $T:expr) => {
                 let fname = filename.with_extension($suffix);
@@ -449,3 +473,21 @@ pub struct GarminRequest {
     pub options: GarminReportOptions,
     pub constraints: GarminConstraints,
 }
+
+#[cfg(test)]
+mod tests {
+    use anyhow::Error;
+    use std::path::Path;
+
+    use crate::garmin_cli::GarminCli;
+
+    #[test]
+    fn test_detect_file_type_from_path() -> Result<(), Error> {
+        let detect = |f: &str| GarminCli::detect_file_type_from_path(Path::new(f));
+        assert_eq!(detect("../tests/data/test.fit")?, Some("fit"));
+        assert_eq!(detect("../tests/data/test.gmn")?, Some("gmn"));
+        assert_eq!(detect("../tests/data/test.tcx")?, Some("tcx"));
+        assert_eq!(detect("../tests/data/test.txt")?, None);
+        Ok(())
+    }
+}
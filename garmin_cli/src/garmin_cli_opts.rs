@@ -7,7 +7,7 @@ use stack_string::StackString;
 use std::path::PathBuf;
 use structopt::StructOpt;
 use tokio::{
-    fs::{read_to_string, File},
+    fs::{read, File},
     io::{stdin, stdout, AsyncReadExt, AsyncWrite, AsyncWriteExt},
     task::spawn_blocking,
 };
@@ -195,16 +195,17 @@ impl GarminCliOpts {
             }
             Self::Import { table, filepath } => {
                 let data = if let Some(filepath) = filepath {
-                    read_to_string(&filepath).await?
+                    read(&filepath).await?
                 } else {
                     let mut stdin = stdin();
-                    let mut buf = String::new();
-                    stdin.read_to_string(&mut buf).await?;
+                    let mut buf = Vec::new();
+                    stdin.read_to_end(&mut buf).await?;
                     buf
                 };
                 match table.as_str() {
                     "scale_measurements" => {
-                        let mut measurements: Vec<ScaleMeasurement> = serde_json::from_str(&data)?;
+                        let mut measurements: Vec<ScaleMeasurement> =
+                            serde_json::from_slice(&data)?;
                         ScaleMeasurement::merge_updates(&mut measurements, &pool).await?;
                         stdout()
                             .write_all(
@@ -213,7 +214,7 @@ impl GarminCliOpts {
                             .await?;
                     }
                     "strava_activities" => {
-                        let activities: Vec<StravaActivity> = serde_json::from_str(&data)?;
+                        let activities: Vec<StravaActivity> = serde_json::from_slice(&data)?;
                         StravaActivity::upsert_activities(&activities, &pool).await?;
                         StravaActivity::fix_summary_id_in_db(&pool).await?;
                         stdout()
@@ -223,7 +224,7 @@ impl GarminCliOpts {
                             .await?;
                     }
                     "fitbit_activities" => {
-                        let activities: Vec<FitbitActivity> = serde_json::from_str(&data)?;
+                        let activities: Vec<FitbitActivity> = serde_json::from_slice(&data)?;
                         FitbitActivity::upsert_activities(&activities, &pool).await?;
                         FitbitActivity::fix_summary_id_in_db(&pool).await?;
                         stdout()
@@ -233,7 +234,7 @@ impl GarminCliOpts {
                             .await?;
                     }
                     "heartrate_statistics_summary" => {
-                        let entries: Vec<FitbitStatisticsSummary> = serde_json::from_str(&data)?;
+                        let entries: Vec<FitbitStatisticsSummary> = serde_json::from_slice(&data)?;
                         let futures = entries.into_iter().map(|entry| {
                             let pool = pool.clone();
                             async move {
@@ -250,7 +251,7 @@ impl GarminCliOpts {
                             .await?;
                     }
                     "garmin_connect_activities" => {
-                        let activities: Vec<GarminConnectActivity> = serde_json::from_str(&data)?;
+                        let activities: Vec<GarminConnectActivity> = serde_json::from_slice(&data)?;
                         GarminConnectActivity::upsert_activities(&activities, &pool).await?;
                         GarminConnectActivity::fix_summary_id_in_db(&pool).await?;
                         stdout()
@@ -261,7 +262,7 @@ impl GarminCliOpts {
                             .await?;
                     }
                     "race_results" => {
-                        let results: Vec<RaceResults> = serde_json::from_str(&data)?;
+                        let results: Vec<RaceResults> = serde_json::from_slice(&data)?;
                         let futures = results.into_iter().map(|result| {
                             let pool = pool.clone();
                             async move {
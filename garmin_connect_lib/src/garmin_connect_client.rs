@@ -2,18 +2,28 @@ use anyhow::{format_err, Error};
 use bytes::Bytes;
 use chrono::{DateTime, NaiveDate, Utc};
 use fantoccini::{Client, ClientBuilder, Locator};
+use futures::{stream, StreamExt, TryStreamExt};
 use http::Method;
+use itertools::Itertools;
 use log::debug;
-use reqwest::Url;
+use reqwest::{
+    header::{HeaderMap, HeaderValue, COOKIE},
+    Url,
+};
 use rweb::Schema;
 use serde::{Deserialize, Serialize};
 use smallvec::SmallVec;
 use stack_string::StackString;
-use std::{path::PathBuf, process::Stdio};
+use std::{
+    path::{Path, PathBuf},
+    process::Stdio,
+};
 use tokio::{
-    fs,
+    fs::{self, File},
+    io::{AsyncWriteExt, BufWriter},
+    net::{TcpListener, TcpStream},
     process::{Child, Command},
-    time::sleep,
+    time::{sleep, Duration, Instant},
 };
 
 use garmin_lib::{
@@ -25,6 +35,13 @@ use garmin_lib::{
 
 use super::garmin_connect_hr_data::GarminConnectHrData;
 
+const MAX_CONCURRENT_DOWNLOADS: usize = 8;
+const WEBDRIVER_STARTUP_TIMEOUT: Duration = Duration::from_secs(10);
+const DOWNLOAD_ATTEMPTS: usize = 3;
+const DOWNLOAD_RETRY_DELAY: Duration = Duration::from_millis(500);
+const USER_AGENT: &str = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) \
+                          Chrome/90.0.4430.212 Safari/537.36";
+
 pub struct GarminConnectClient {
     config: GarminConfig,
     client: Option<Client>,
@@ -67,14 +84,18 @@ impl GarminConnectClient {
             ));
         }
         if self.trigger_auth {
+            let port = match self.config.webdriver_port {
+                0 => Self::get_free_port().await?,
+                port => port,
+            };
             let webdriver = Command::new(&self.config.webdriver_path)
-                .args(&[&format!("--port={}", self.config.webdriver_port)])
+                .args(&[&format!("--port={}", port)])
                 .kill_on_drop(true)
                 .stdout(Stdio::piped())
                 .stderr(Stdio::piped())
                 .spawn()?;
             self.webdriver.replace(webdriver);
-            sleep(std::time::Duration::from_secs(5)).await;
+            Self::wait_for_webdriver(port).await?;
 
             let mut caps = serde_json::map::Map::new();
             let opts = serde_json::json!({
@@ -91,14 +112,9 @@ impl GarminConnectClient {
             caps.insert("unhandledPromptBehavior".to_string(), "accept".into());
             let mut client = ClientBuilder::rustls()
                 .capabilities(caps)
-                .connect(&format!("http://localhost:{}", self.config.webdriver_port))
-                .await?;
-            client
-                .set_ua(
-                    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) \
-                     Chrome/90.0.4430.212 Safari/537.36",
-                )
+                .connect(&format!("http://localhost:{}", port))
                 .await?;
+            client.set_ua(USER_AGENT).await?;
 
             self.client.replace(client);
             self.last_used = Utc::now();
@@ -110,6 +126,24 @@ impl GarminConnectClient {
         Ok(())
     }
 
+    /// Let the kernel pick an unused local port for the webdriver
+    async fn get_free_port() -> Result<u32, Error> {
+        let listener = TcpListener::bind("127.0.0.1:0").await?;
+        Ok(listener.local_addr()?.port().into())
+    }
+
+    async fn wait_for_webdriver(port: u32) -> Result<(), Error> {
+        let addr = format!("127.0.0.1:{}", port);
+        let deadline = Instant::now() + WEBDRIVER_STARTUP_TIMEOUT;
+        while TcpStream::connect(&addr).await.is_err() {
+            if Instant::now() > deadline {
+                return Err(format_err!("Webdriver failed to start on port {}", port));
+            }
+            sleep(Duration::from_millis(100)).await;
+        }
+        Ok(())
+    }
+
     async fn raw_get(client: &mut Client, url: &Url) -> Result<Bytes, Error> {
         let raw = client.raw_client_for(Method::GET, url.as_str()).await?;
         hyper::body::to_bytes(raw.into_body())
@@ -117,6 +151,61 @@ impl GarminConnectClient {
             .map_err(Into::into)
     }
 
+    fn download_client(cookies: &str) -> Result<reqwest::Client, Error> {
+        let mut headers = HeaderMap::new();
+        headers.insert(COOKIE, HeaderValue::from_str(cookies)?);
+        reqwest::Client::builder()
+            .user_agent(USER_AGENT)
+            .default_headers(headers)
+            .build()
+            .map_err(Into::into)
+    }
+
+    async fn download_to_file(
+        client: &reqwest::Client,
+        url: Url,
+        fname: &Path,
+    ) -> Result<(), Error> {
+        let mut tmp_file = fname.as_os_str().to_owned();
+        tmp_file.push(".part");
+        let tmp_file = PathBuf::from(tmp_file);
+        let mut delay = DOWNLOAD_RETRY_DELAY;
+        let mut attempt = 1;
+        loop {
+            let result = match Self::download_attempt(client, url.clone(), &tmp_file).await {
+                Ok(()) => fs::rename(&tmp_file, fname).await.map_err(Into::into),
+                Err(e) => Err(e),
+            };
+            match result {
+                Ok(()) => return Ok(()),
+                Err(e) => {
+                    fs::remove_file(&tmp_file).await.ok();
+                    if attempt >= DOWNLOAD_ATTEMPTS || !is_transient_error(&e) {
+                        return Err(e);
+                    }
+                    debug!("retry download of {} after {}", url, e);
+                    sleep(delay).await;
+                    delay *= 2;
+                    attempt += 1;
+                }
+            }
+        }
+    }
+
+    async fn download_attempt(
+        client: &reqwest::Client,
+        url: Url,
+        fname: &Path,
+    ) -> Result<(), Error> {
+        let mut resp = client.get(url).send().await?.error_for_status()?;
+        let mut f = BufWriter::new(File::create(fname).await?);
+        while let Some(chunk) = resp.chunk().await? {
+            f.write_all(&chunk).await?;
+        }
+        f.flush().await?;
+        Ok(())
+    }
+
     pub async fn authorize(&mut self) -> Result<(), Error> {
         let client = self
             .client
@@ -148,7 +237,7 @@ impl GarminConnectClient {
             .await?
             .set_by_name("password", &self.config.garmin_connect_password)
             .await?;
-        sleep(std::time::Duration::from_secs(1)).await;
+        sleep(Duration::from_secs(1)).await;
         client
             .find(Locator::XPath("//*[@name=\"rememberme\"]"))
             .await?
@@ -299,29 +388,43 @@ impl GarminConnectClient {
             .client
             .as_mut()
             .ok_or_else(|| format_err!("No client"))?;
-        let mut filenames = Vec::new();
-
-        fs::create_dir_all(&self.config.download_directory).await?;
-
-        for activity in activities {
-            let fname = self
-                .config
-                .download_directory
-                .join(activity.activity_id.to_string())
-                .with_extension("zip");
-            let url = self
-                .config
-                .garmin_connect_api_endpoint
-                .as_ref()
-                .ok_or_else(|| format_err!("Bad URL"))?
-                .join("/proxy/download-service/files/activity/")?
-                .join(&activity.activity_id.to_string())?;
-            let data = Self::raw_get(client, &url).await?;
-            self.last_used = Utc::now();
-            fs::write(&fname, &data).await?;
-            filenames.push(fname);
+        let download_directory = &self.config.download_directory;
+        let api_endpoint = self
+            .config
+            .garmin_connect_api_endpoint
+            .as_ref()
+            .ok_or_else(|| format_err!("Bad URL"))?;
+        let download_url = api_endpoint.join("/proxy/download-service/files/activity/")?;
+
+        fs::create_dir_all(download_directory).await?;
+
+        // every clone of the fantoccini client drives the same browser session,
+        // so take its cookies once and run the downloads over plain http
+        if client.current_url().await?.origin() != download_url.origin() {
+            client.goto(api_endpoint.as_str()).await?;
         }
-        Ok(filenames)
+        let cookies = client.get_all_cookies().await?;
+        let http_client = Self::download_client(&cookie_header(
+            cookies.iter().map(|c| (c.name(), c.value())),
+        ))?;
+
+        let futures = activities.iter().map(|activity| {
+            let http_client = &http_client;
+            let download_url = &download_url;
+            async move {
+                let activity_id = activity.activity_id.to_string();
+                let fname = download_directory.join(&activity_id).with_extension("zip");
+                let url = download_url.join(&activity_id)?;
+                Self::download_to_file(http_client, url, &fname).await?;
+                Ok(fname)
+            }
+        });
+        let filenames: Result<Vec<_>, Error> = stream::iter(futures)
+            .buffered(MAX_CONCURRENT_DOWNLOADS)
+            .try_collect()
+            .await;
+        self.last_used = Utc::now();
+        filenames
     }
 
     pub async fn get_and_merge_activity_files(
@@ -334,6 +437,30 @@ impl GarminConnectClient {
     }
 }
 
+fn cookie_header<'a, I>(cookies: I) -> String
+where
+    I: IntoIterator<Item = (&'a str, &'a str)>,
+{
+    cookies
+        .into_iter()
+        .map(|(name, value)| format!("{}={}", name, value))
+        .join("; ")
+}
+
+/// Connection failures, timeouts, truncated bodies and 5xx responses are
+/// worth another attempt, anything else (e.g. an expired session) is not.
+fn is_transient_error(e: &Error) -> bool {
+    match e.downcast_ref::<reqwest::Error>() {
+        Some(e) => {
+            e.is_connect()
+                || e.is_timeout()
+                || e.is_body()
+                || e.status().map_or(false, |s| s.is_server_error())
+        }
+        None => false,
+    }
+}
+
 #[derive(Serialize, Deserialize, Debug, Schema)]
 pub struct GarminConnectUserDailySummary {
     #[serde(rename = "userProfileId")]
@@ -359,13 +486,121 @@ mod tests {
     use anyhow::Error;
     use chrono::{Duration, Utc};
     use futures::future::try_join_all;
+    use reqwest::Url;
     use std::collections::HashMap;
+    use tokio::{
+        io::{AsyncReadExt, AsyncWriteExt},
+        net::TcpListener,
+    };
 
     use garmin_lib::common::{
         garmin_config::GarminConfig, garmin_connect_activity::GarminConnectActivity, pgpool::PgPool,
     };
 
-    use crate::garmin_connect_client::GarminConnectClient;
+    use crate::garmin_connect_client::{cookie_header, GarminConnectClient};
+
+    #[test]
+    fn test_cookie_header() {
+        assert_eq!(cookie_header(vec![]), "");
+        assert_eq!(
+            cookie_header(vec![("SESSIONID", "abc"), ("GARMIN-SSO", "1")]),
+            "SESSIONID=abc; GARMIN-SSO=1"
+        );
+    }
+
+    #[tokio::test]
+    async fn test_download_to_file() -> Result<(), Error> {
+        let listener = TcpListener::bind("127.0.0.1:0").await?;
+        let addr = listener.local_addr()?;
+        let server = tokio::spawn(async move {
+            let mut requests = Vec::new();
+            for _ in 0..3 {
+                let (mut stream, _) = listener.accept().await?;
+                let mut request: Vec<u8> = Vec::new();
+                let mut buf = [0_u8; 1024];
+                while !request.windows(4).any(|w| w == b"\r\n\r\n") {
+                    let n = stream.read(&mut buf).await?;
+                    if n == 0 {
+                        break;
+                    }
+                    request.extend_from_slice(&buf[..n]);
+                }
+                stream
+                    .write_all(
+                        b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello",
+                    )
+                    .await?;
+                requests.push(String::from_utf8_lossy(&request).to_lowercase());
+            }
+            Ok::<_, std::io::Error>(requests)
+        });
+
+        let client =
+            GarminConnectClient::download_client(&cookie_header(vec![("SESSIONID", "abc")]))?;
+        let directory = std::env::temp_dir().join(format!("garmin_download_{}", addr.port()));
+        tokio::fs::create_dir_all(&directory).await?;
+        let futures = (0..3).map(|idx| {
+            let client = &client;
+            let fname = directory.join(format!("{}.zip", idx));
+            async move {
+                let url = Url::parse(&format!("http://{}/activity/{}", addr, idx))?;
+                GarminConnectClient::download_to_file(client, url, &fname).await?;
+                Ok(fname)
+            }
+        });
+        let filenames: Result<Vec<_>, Error> = try_join_all(futures).await;
+        for fname in filenames? {
+            assert_eq!(tokio::fs::read(&fname).await?, b"hello");
+        }
+        tokio::fs::remove_dir_all(&directory).await?;
+
+        let requests = server.await??;
+        assert_eq!(requests.len(), 3);
+        for request in &requests {
+            assert!(request.contains("cookie: sessionid=abc"));
+        }
+        Ok(())
+    }
+
+    #[tokio::test]
+    async fn test_download_to_file_retry() -> Result<(), Error> {
+        let listener = TcpListener::bind("127.0.0.1:0").await?;
+        let addr = listener.local_addr()?;
+        let server = tokio::spawn(async move {
+            let responses: [&[u8]; 2] = [
+                b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: \
+                  close\r\n\r\n",
+                b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello",
+            ];
+            for response in &responses {
+                let (mut stream, _) = listener.accept().await?;
+                let mut request: Vec<u8> = Vec::new();
+                let mut buf = [0_u8; 1024];
+                while !request.windows(4).any(|w| w == b"\r\n\r\n") {
+                    let n = stream.read(&mut buf).await?;
+                    if n == 0 {
+                        break;
+                    }
+                    request.extend_from_slice(&buf[..n]);
+                }
+                stream.write_all(response).await?;
+            }
+            Ok::<_, std::io::Error>(())
+        });
+
+        let client = GarminConnectClient::download_client("")?;
+        let directory = std::env::temp_dir().join(format!("garmin_download_{}", addr.port()));
+        tokio::fs::create_dir_all(&directory).await?;
+        let fname = directory.join("0.zip");
+        let url = Url::parse(&format!("http://{}/activity/0", addr))?;
+        GarminConnectClient::download_to_file(&client, url, &fname).await?;
+        assert_eq!(tokio::fs::read(&fname).await?, b"hello");
+        assert!(!directory.join("0.zip.part").exists());
+        tokio::fs::remove_dir_all(&directory).await?;
+
+        server.await??;
+        Ok(())
+    }
 
     #[test]
     fn test_extract_display_name() -> Result<(), Error> {
@@ -42,6 +42,11 @@ use strava_lib::strava_client::{StravaAthlete, StravaClient};
 
 use crate::{errors::ServiceError as Error, garmin_rust_app::ConnectProxy};
 
+const STRAVA_AUTH_SUCCESS: &str = r#"
+    <title>Strava auth code received!</title>
+    This window can be closed.
+    <script language="JavaScript" type="text/javascript">window.close()</script>"#;
+
 pub struct GarminHtmlRequest {
     pub request: GarminRequest,
     pub is_demo: bool,
@@ -548,11 +553,7 @@ impl StravaRefreshRequest {
         let mut client = StravaClient::from_file(config.clone()).await?;
         client.refresh_access_token().await?;
         client.to_file().await?;
-        let body = r#"
-            <title>Strava auth code received!</title>
-            This window can be closed.
-            <script language="JavaScript" type="text/javascript">window.close()</script>"#;
-        Ok(body.into())
+        Ok(STRAVA_AUTH_SUCCESS.into())
     }
 }
 
@@ -567,11 +568,7 @@ impl StravaCallbackRequest {
         let mut client = StravaClient::from_file(config.clone()).await?;
         client.process_callback(&self.code, &self.state).await?;
         client.to_file().await?;
-        let body = r#"
-            <title>Strava auth code received!</title>
-            This window can be closed.
-            <script language="JavaScript" type="text/javascript">window.close()</script>"#;
-        Ok(body.into())
+        Ok(STRAVA_AUTH_SUCCESS.into())
     }
 }
 
@@ -231,12 +231,35 @@ pub fn deserialize_start_time<'de, D>(deserializer: D) -> Result<DateTimeWrapper
 where
     D: Deserializer<'de>,
 {
-    let s = String::deserialize(deserializer)?;
-    if let Ok(dt) = s.parse() {
-        Ok(dt)
+    let s = StackString::deserialize(deserializer)?;
+    if let Ok(datetime) = NaiveDateTime::parse_from_str(&s, "%Y-%m-%d %H:%M:%S") {
+        Ok(DateTime::from_utc(datetime, Utc).into())
     } else {
-        NaiveDateTime::parse_from_str(&s, "%Y-%m-%d %H:%M:%S")
-            .map(|datetime| DateTime::from_utc(datetime, Utc).into())
-            .map_err(serde::de::Error::custom)
+        s.parse().map_err(serde::de::Error::custom)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use anyhow::Error;
+
+    use crate::{
+        common::garmin_connect_activity::GarminConnectActivity,
+        utils::iso_8601_datetime::convert_datetime_to_str,
+    };
+
+    #[test]
+    fn test_deserialize_start_time() -> Result<(), Error> {
+        let buf = include_str!("../../../tests/data/garmin_connect_activities.json");
+        let activities: Vec<GarminConnectActivity> = serde_json::from_str(buf)?;
+        assert_eq!(
+            convert_datetime_to_str(*activities[0].start_time_gmt),
+            "2020-06-15T12:12:49Z"
+        );
+
+        let buf = serde_json::to_string(&activities[0])?;
+        let activity: GarminConnectActivity = serde_json::from_str(&buf)?;
+        assert_eq!(activity.start_time_gmt, activities[0].start_time_gmt);
+        Ok(())
     }
 }
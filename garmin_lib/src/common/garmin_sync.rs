@@ -166,7 +166,6 @@ impl GarminSync {
                             do_upload = true;
                         }
                     }
-                    if tmod != item.timestamp && check_md5sum {}
                 } else {
                     do_upload = true;
                 }
@@ -193,8 +192,7 @@ impl GarminSync {
                 let res = || {
                     let mut do_download = false;
 
-                    if file_set.contains_key(&item.key) {
-                        let (tmod_, size_) = file_set[&item.key];
+                    if let Some(&(tmod_, size_)) = file_set.get(&item.key) {
                         if item.timestamp > tmod_ {
                             if check_md5sum {
                                 let file_name = local_dir.join(item.key.as_str());
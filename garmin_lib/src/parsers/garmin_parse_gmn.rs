@@ -1,6 +1,6 @@
 use anyhow::{format_err, Error};
 use chrono::{DateTime, Utc};
-use roxmltree::{Document, NodeType};
+use roxmltree::Document;
 use std::{collections::HashMap, path::Path};
 use subprocess::{Exec, Redirection};
 
@@ -16,6 +16,8 @@ use crate::{
 
 use super::garmin_parse::{GarminParseTrait, ParseOutput};
 
+const GARMIN_DUMP: &str = "/usr/bin/garmin_dump";
+
 #[derive(Debug, Default)]
 pub struct GarminParseGmn {}
 
@@ -61,44 +63,49 @@ impl GarminParseTrait for GarminParseGmn {
     }
 
     fn parse_file(&self, filename: &Path) -> Result<ParseOutput, Error> {
-        let filename = filename.to_string_lossy().to_string();
-        assert!(Path::new("/usr/bin/garmin_dump").exists());
-        let command = format!(
-            "echo \"{}\" `garmin_dump {}` \"{}\"",
-            "<root>", filename, "</root>"
-        );
-
-        let output = Exec::shell(command)
+        if !Path::new(GARMIN_DUMP).exists() {
+            return Err(format_err!(
+                "{} not found, cannot parse gmn files",
+                GARMIN_DUMP
+            ));
+        }
+        let capture = Exec::cmd(GARMIN_DUMP)
+            .arg(filename)
             .stdout(Redirection::Pipe)
-            .capture()?
-            .stdout_str();
+            .capture()?;
+        if !capture.success() {
+            return Err(format_err!(
+                "{} failed on {:?}: {:?}",
+                GARMIN_DUMP,
+                filename,
+                capture.exit_status
+            ));
+        }
+        let output = format!("<root>{}</root>", capture.stdout_str());
         let doc = Document::parse(&output).map_err(|e| format_err!("{}", e))?;
 
         let mut lap_list = Vec::new();
         let mut point_list = Vec::new();
         let mut sport = SportTypes::None;
 
-        for d in doc.root().descendants() {
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "run" {
-                for a in d.attributes() {
-                    if a.name() == "sport" {
-                        if let Ok(sp) = a.value().parse() {
-                            sport = sp;
-                        }
+        for d in doc.root().descendants().filter(|d| d.is_element()) {
+            match d.tag_name().name() {
+                "run" => {
+                    if let Some(sp) = d.attribute("sport").and_then(|sp| sp.parse().ok()) {
+                        sport = sp;
                     }
                 }
-            }
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "lap" {
-                lap_list.push(GarminLap::read_lap_xml(&d)?);
-            }
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "point" {
-                let new_point = GarminPoint::read_point_xml(&d)?;
-                if new_point.latitude.is_some()
-                    && new_point.longitude.is_some()
-                    && new_point.distance > Some(0.0)
-                {
-                    point_list.push(new_point);
+                "lap" => lap_list.push(GarminLap::read_lap_xml(&d)?),
+                "point" => {
+                    let new_point = GarminPoint::read_point_xml(&d)?;
+                    if new_point.latitude.is_some()
+                        && new_point.longitude.is_some()
+                        && new_point.distance > Some(0.0)
+                    {
+                        point_list.push(new_point);
+                    }
                 }
+                _ => {}
             }
         }
 
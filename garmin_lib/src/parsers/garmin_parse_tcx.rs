@@ -1,12 +1,12 @@
 use anyhow::{format_err, Error};
 use chrono::{DateTime, Utc};
-use flate2::read::GzDecoder;
-use roxmltree::{Document, NodeType};
+use flate2::bufread::GzDecoder;
+use roxmltree::Document;
 use std::{
     collections::HashMap,
     ffi::OsStr,
     fs::{read_to_string, File},
-    io::Read,
+    io::{BufReader, Read},
     path::Path,
 };
 
@@ -72,7 +72,8 @@ impl GarminParseTrait for GarminParseTcx {
     fn parse_file(&self, filename: &Path) -> Result<ParseOutput, Error> {
         let output = if self.is_gzip {
             let mut buf = String::new();
-            GzDecoder::new(File::open(filename)?).read_to_string(&mut buf)?;
+            GzDecoder::new(BufReader::with_capacity(256 * 1024, File::open(filename)?))
+                .read_to_string(&mut buf)?;
             buf
         } else {
             read_to_string(filename)?
@@ -83,26 +84,24 @@ impl GarminParseTrait for GarminParseTcx {
         let mut point_list = Vec::new();
         let mut sport = SportTypes::None;
 
-        for d in doc.root().descendants() {
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "Activity" {
-                for a in d.attributes() {
-                    if a.name() == "Sport" {
-                        sport = a.value().parse().unwrap_or(SportTypes::None);
+        for d in doc.root().descendants().filter(|d| d.is_element()) {
+            match d.tag_name().name() {
+                "Activity" => {
+                    if let Some(sp) = d.attribute("Sport") {
+                        sport = sp.parse().unwrap_or(SportTypes::None);
                     }
                 }
-            }
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "Lap" {
-                let new_lap = GarminLap::read_lap_tcx(&d)?;
-                lap_list.push(new_lap);
-            }
-            if d.node_type() == NodeType::Element && d.tag_name().name() == "Trackpoint" {
-                let new_point = GarminPoint::read_point_tcx(&d)?;
-                if new_point.latitude.is_some()
-                    && new_point.longitude.is_some()
-                    && new_point.distance > Some(0.0)
-                {
-                    point_list.push(new_point);
+                "Lap" => lap_list.push(GarminLap::read_lap_tcx(&d)?),
+                "Trackpoint" => {
+                    let new_point = GarminPoint::read_point_tcx(&d)?;
+                    if new_point.latitude.is_some()
+                        && new_point.longitude.is_some()
+                        && new_point.distance > Some(0.0)
+                    {
+                        point_list.push(new_point);
+                    }
                 }
+                _ => {}
             }
         }
 
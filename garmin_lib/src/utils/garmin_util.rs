@@ -1,7 +1,6 @@
 use anyhow::{format_err, Error};
 use chrono::{DateTime, TimeZone, Utc};
 use fitparser::Value;
-use flate2::{read::GzEncoder, Compression};
 use log::{debug, error};
 use num_traits::pow::Pow;
 use rand::{
@@ -11,7 +10,7 @@ use rand::{
 use smallvec::SmallVec;
 use stack_string::StackString;
 use std::{
-    fs::{remove_file, File},
+    fs::remove_file,
     future::Future,
     io::{BufRead, BufReader, Read},
     path::{Path, PathBuf},
@@ -197,21 +196,30 @@ pub fn extract_zip_from_garmin_connect(
     Ok(new_filename)
 }
 
-pub fn gzip_file<T, U>(input_filename: T, output_filename: U) -> Result<(), Error>
-where
-    T: AsRef<Path>,
-    U: AsRef<Path>,
-{
-    let input_filename = input_filename.as_ref();
-    let output_filename = output_filename.as_ref();
-    if !input_filename.exists() {
-        return Err(format_err!("File {:?} does not exist", input_filename));
-    }
-    std::io::copy(
-        &mut GzEncoder::new(File::open(input_filename)?, Compression::fast()),
-        &mut File::create(output_filename)?,
-    )?;
-    Ok(())
+/// Number of leading bytes needed by `detect_file_type`
+pub const FILE_HEAD_SIZE: usize = 256;
+
+const FILE_MAGIC: [(&str, &[u8], Option<usize>); 3] = [
+    ("fit", b".FIT", Some(8)),
+    ("gmn", b"<@gArMiN@>", Some(0)),
+    ("tcx", b"<TrainingCenterDatabase", None),
+];
+
+/// Identify an activity file from the first `FILE_HEAD_SIZE` bytes of its
+/// contents, returning the matching file extension.
+pub fn detect_file_type(head: &[u8]) -> Option<&'static str> {
+    let head = &head[..head.len().min(FILE_HEAD_SIZE)];
+    FILE_MAGIC.iter().find_map(|(suffix, magic, offset)| {
+        let found = match offset {
+            Some(offset) => head.get(*offset..).map_or(false, |h| h.starts_with(magic)),
+            None => head.windows(magic.len()).any(|w| w == *magic),
+        };
+        if found {
+            Some(*suffix)
+        } else {
+            None
+        }
+    })
 }
 
 pub fn get_f64(value: &Value) -> Option<f64> {
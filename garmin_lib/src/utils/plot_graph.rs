@@ -1,13 +1,90 @@
 use anyhow::{format_err, Error};
+use lazy_static::lazy_static;
 use log::debug;
 use maplit::hashmap;
+use parking_lot::Mutex;
 use stack_string::StackString;
-use std::collections::HashMap;
+use std::{
+    collections::{hash_map::DefaultHasher, HashMap, VecDeque},
+    hash::{Hash, Hasher},
+};
 
 use crate::{common::garmin_templates::HBR, utils::plot_opts::PlotOpts};
 
-#[allow(clippy::similar_names)]
+const PLOT_CACHE_SIZE: usize = 64;
+
+lazy_static! {
+    static ref PLOT_CACHE: Mutex<PlotCache> = Mutex::new(PlotCache::new(PLOT_CACHE_SIZE));
+}
+
+/// Least recently used cache of rendered plots
+struct PlotCache {
+    capacity: usize,
+    entries: HashMap<u64, StackString>,
+    order: VecDeque<u64>,
+}
+
+impl PlotCache {
+    fn new(capacity: usize) -> Self {
+        Self {
+            capacity,
+            entries: HashMap::with_capacity(capacity),
+            order: VecDeque::with_capacity(capacity),
+        }
+    }
+
+    fn touch(&mut self, key: u64) {
+        if let Some(idx) = self.order.iter().position(|k| *k == key) {
+            self.order.remove(idx);
+        }
+        self.order.push_back(key);
+    }
+
+    fn get(&mut self, key: u64) -> Option<StackString> {
+        let body = self.entries.get(&key).cloned()?;
+        self.touch(key);
+        Some(body)
+    }
+
+    fn insert(&mut self, key: u64, body: StackString) {
+        if !self.entries.contains_key(&key) && self.entries.len() >= self.capacity {
+            if let Some(oldest) = self.order.pop_front() {
+                self.entries.remove(&oldest);
+            }
+        }
+        self.entries.insert(key, body);
+        self.touch(key);
+    }
+}
+
+fn plot_cache_key(opts: &PlotOpts) -> u64 {
+    let mut hasher = DefaultHasher::new();
+    opts.name.hash(&mut hasher);
+    opts.title.hash(&mut hasher);
+    opts.do_scatter.hash(&mut hasher);
+    opts.xlabel.hash(&mut hasher);
+    opts.ylabel.hash(&mut hasher);
+    if let Some(data) = opts.data {
+        for (x, y) in data {
+            x.to_bits().hash(&mut hasher);
+            y.to_bits().hash(&mut hasher);
+        }
+    }
+    hasher.finish()
+}
+
 pub fn generate_d3_plot(opts: &PlotOpts) -> Result<StackString, Error> {
+    let key = plot_cache_key(opts);
+    if let Some(body) = PLOT_CACHE.lock().get(key) {
+        return Ok(body);
+    }
+    let body = render_d3_plot(opts)?;
+    PLOT_CACHE.lock().insert(key, body.clone());
+    Ok(body)
+}
+
+#[allow(clippy::similar_names)]
+fn render_d3_plot(opts: &PlotOpts) -> Result<StackString, Error> {
     let err_str = format!("No data points {}", opts.name);
 
     let data = match opts.data.as_ref() {
@@ -22,49 +99,31 @@ pub fn generate_d3_plot(opts: &PlotOpts) -> Result<StackString, Error> {
 
     let body = if opts.do_scatter {
         let nbins = 10;
-        let xmin = data
-            .iter()
-            .map(|(x, _)| x)
-            .min_by_key(|&x| (*x * 1000.) as i64)
-            .copied()
-            .unwrap_or(0.0);
+        let (xmin, xmax, ymin, ymax) = data.iter().fold(
+            (
+                f64::INFINITY,
+                f64::NEG_INFINITY,
+                f64::INFINITY,
+                f64::NEG_INFINITY,
+            ),
+            |(xmin, xmax, ymin, ymax), (x, y)| {
+                (xmin.min(*x), xmax.max(*x), ymin.min(*y), ymax.max(*y))
+            },
+        );
         let xmin = xmin - 0.01 * xmin.abs();
-        let xmax = data
-            .iter()
-            .map(|(x, _)| x)
-            .max_by_key(|&x| (*x * 1000.) as i64)
-            .copied()
-            .unwrap_or(0.0);
         let xmax = xmax + 0.01 * xmax.abs();
         let xstep = (xmax - xmin) / (nbins as f64);
-        let ymin = data
-            .iter()
-            .map(|(_, y)| y)
-            .min_by_key(|&x| (*x * 1000.) as i64)
-            .copied()
-            .unwrap_or(0.0);
         let ymin = ymin - 0.01 * ymin.abs();
-        let ymax = data
-            .iter()
-            .map(|(_, y)| y)
-            .max_by_key(|&x| (*x * 1000.) as i64)
-            .copied()
-            .unwrap_or(0.0);
         let ymax = ymax + 0.01 * ymax.abs();
         let ystep = (ymax - ymin) / (nbins as f64);
 
-        let mut bins: HashMap<(u64, u64), u64> = HashMap::new();
-        for xbin in 0..nbins {
-            for ybin in 0..nbins {
-                bins.insert((xbin, ybin), 0);
-            }
-        }
+        let mut bins = vec![0_u64; nbins * nbins];
 
         for (x, y) in data.iter() {
-            let xindex = ((x - xmin) / xstep) as u64;
-            let yindex = ((y - ymin) / ystep) as u64;
-            if let Some(x) = bins.get_mut(&(xindex, yindex)) {
-                *x += 1;
+            let xindex = ((x - xmin) / xstep) as usize;
+            let yindex = ((y - ymin) / ystep) as usize;
+            if xindex < nbins && yindex < nbins {
+                bins[xindex * nbins + yindex] += 1;
             } else {
                 debug!(
                     "missing {} {} {} {} {} {} {} {}",
@@ -75,7 +134,11 @@ pub fn generate_d3_plot(opts: &PlotOpts) -> Result<StackString, Error> {
 
         let data: Vec<_> = bins
             .iter()
-            .map(|((xb, yb), c)| (*xb as f64 * xstep + xmin, *yb as f64 * ystep + ymin, c))
+            .enumerate()
+            .map(|(idx, c)| {
+                let (xb, yb) = (idx / nbins, idx % nbins);
+                (xb as f64 * xstep + xmin, yb as f64 * ystep + ymin, c)
+            })
             .collect();
 
         let xstep = xstep.to_string();
@@ -106,3 +169,44 @@ pub fn generate_d3_plot(opts: &PlotOpts) -> Result<StackString, Error> {
     };
     Ok(body)
 }
+
+#[cfg(test)]
+mod tests {
+    use stack_string::StackString;
+
+    use crate::utils::{
+        plot_graph::{generate_d3_plot, plot_cache_key, PlotCache, PLOT_CACHE},
+        plot_opts::PlotOpts,
+    };
+
+    #[test]
+    fn test_plot_cache_evicts_least_recently_used() {
+        let mut cache = PlotCache::new(2);
+        cache.insert(1, StackString::from("one"));
+        cache.insert(2, StackString::from("two"));
+        assert_eq!(cache.get(1), Some(StackString::from("one")));
+        cache.insert(3, StackString::from("three"));
+        assert_eq!(cache.get(2), None);
+        assert_eq!(cache.get(1), Some(StackString::from("one")));
+        assert_eq!(cache.get(3), Some(StackString::from("three")));
+        assert_eq!(cache.entries.len(), 2);
+        assert_eq!(cache.order.len(), 2);
+    }
+
+    #[test]
+    fn test_generate_d3_plot_cached() {
+        let test_data = vec![(0.1, 0.2), (1.0, 2.0), (3.0, 4.0)];
+        let plot_opts = PlotOpts::new()
+            .with_labels("Test X label", "Test Y label")
+            .with_name("test_cached_plot")
+            .with_title("cached title")
+            .with_data(&test_data)
+            .with_scatter();
+        let key = plot_cache_key(&plot_opts);
+
+        let first = generate_d3_plot(&plot_opts).unwrap();
+        assert_eq!(PLOT_CACHE.lock().get(key).as_ref(), Some(&first));
+        let second = generate_d3_plot(&plot_opts).unwrap();
+        assert_eq!(first, second);
+    }
+}
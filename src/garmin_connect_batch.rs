@@ -13,10 +13,9 @@
 use anyhow::{format_err, Error};
 use chrono::{Duration, Utc};
 use fitbit_lib::fitbit_heartrate::FitbitHeartRate;
+use futures::future::try_join_all;
 use garmin_connect_lib::garmin_connect_client::GarminConnectClient;
-use garmin_lib::common::{
-    garmin_config::GarminConfig, garmin_connect_activity::GarminConnectActivity,
-};
+use garmin_lib::common::garmin_config::GarminConfig;
 use log::debug;
 use maplit::hashmap;
 use reqwest::{
@@ -24,19 +23,120 @@ use reqwest::{
     Client,
 };
 use serde::Deserialize;
-use std::collections::HashSet;
+use std::{collections::HashSet, path::PathBuf, time};
+use tokio::try_join;
 use url::Url;
 
-#[tokio::main]
-async fn main() -> Result<(), Error> {
+const CONNECT_TIMEOUT: time::Duration = time::Duration::from_secs(5);
+
+async fn remote_login(
+    client: &Client,
+    remote_url: &Url,
+    remote_email: &str,
+    remote_password: &str,
+) -> Result<(), Error> {
     #[derive(Deserialize, Debug)]
     struct LoggedUser {
         email: String,
     }
 
+    let data = hashmap! {
+        "email" => remote_email,
+        "password" => remote_password,
+    };
+
+    let url = remote_url.join("api/auth")?;
+    let user: LoggedUser = client
+        .post(url)
+        .json(&data)
+        .send()
+        .await?
+        .error_for_status()?
+        .json()
+        .await?;
+    debug!("Logged in {:?}", user);
+    Ok(())
+}
+
+async fn get_remote_activity_ids(client: &Client, remote_url: &Url) -> Result<HashSet<i64>, Error> {
+    #[derive(Deserialize)]
+    struct ActivityId {
+        #[serde(rename = "activityId")]
+        activity_id: i64,
+    }
+
+    let url = remote_url.join("/garmin/garmin_connect_activities_db")?;
+    let db_activities: Vec<ActivityId> = client
+        .get(url)
+        .send()
+        .await?
+        .error_for_status()?
+        .json()
+        .await?;
+    Ok(db_activities.into_iter().map(|a| a.activity_id).collect())
+}
+
+async fn post_heartrate_updates(
+    client: &Client,
+    remote_url: &Url,
+    updates: Vec<Vec<FitbitHeartRate>>,
+) -> Result<(), Error> {
+    let url = remote_url.join("/garmin/fitbit/heartrate_cache")?;
+    let futures = updates.into_iter().map(|hr_values| {
+        let url = url.clone();
+        async move {
+            let data = hashmap! {
+                "updates" => hr_values,
+            };
+            client
+                .post(url)
+                .json(&data)
+                .send()
+                .await?
+                .error_for_status()?;
+            Ok(())
+        }
+    });
+    let results: Result<Vec<_>, Error> = try_join_all(futures).await;
+    results?;
+    Ok(())
+}
+
+async fn upload_activity_files(
+    client: &Client,
+    remote_url: &Url,
+    filenames: &[PathBuf],
+) -> Result<(), Error> {
+    // each upload triggers a full sync and processing pass on the server, so
+    // send them one at a time
+    let url = remote_url.join("/garmin/upload_file")?;
+    for filename in filenames {
+        let dname = filename
+            .file_name()
+            .ok_or_else(|| format_err!("no filename"))?
+            .to_string_lossy();
+        let fname = filename.to_string_lossy().to_string();
+        let url = Url::parse_with_params(url.as_str(), &[("filename", dname)])?;
+        let part = Part::bytes(tokio::fs::read(filename).await?).file_name(fname);
+        let form = Form::new().part("file", part);
+        client
+            .post(url)
+            .multipart(form)
+            .send()
+            .await?
+            .error_for_status()?;
+    }
+    Ok(())
+}
+
+#[tokio::main]
+async fn main() -> Result<(), Error> {
     env_logger::init();
 
-    let client = Client::builder().cookie_store(true).build()?;
+    let client = Client::builder()
+        .cookie_store(true)
+        .connect_timeout(CONNECT_TIMEOUT)
+        .build()?;
 
     let config = GarminConfig::get_config(None)?;
 
@@ -53,80 +153,34 @@ async fn main() -> Result<(), Error> {
         .as_ref()
         .ok_or_else(|| format_err!("No remote password given"))?;
 
-    let data = hashmap! {
-        "email" => remote_email.as_str(),
-        "password" => remote_password.as_str(),
-    };
-
-    let url = remote_url.join("api/auth")?;
-    let user: LoggedUser = client
-        .post(url)
-        .json(&data)
-        .send()
-        .await?
-        .error_for_status()?
-        .json()
-        .await?;
-    debug!("Logged in {:?}", user);
-
     let mut connect = GarminConnectClient::new(config.clone());
-    connect.init().await?;
+    try_join!(
+        remote_login(&client, remote_url, remote_email, remote_password),
+        connect.init(),
+    )?;
 
+    let mut heartrate_updates = Vec::new();
     for idx in 0..3 {
         let date = (Utc::now() - Duration::days(idx)).naive_utc().date();
         let hr_values = connect.get_heartrate(date).await?;
         let hr_values = FitbitHeartRate::from_garmin_connect_hr(&hr_values);
         if !hr_values.is_empty() {
-            let data = hashmap! {
-                "updates" => hr_values,
-            };
-            let url = remote_url.join("/garmin/fitbit/heartrate_cache")?;
-            client
-                .post(url)
-                .json(&data)
-                .send()
-                .await?
-                .error_for_status()?;
+            heartrate_updates.push(hr_values);
         }
     }
 
-    let connect_activities = connect
-        .get_activities(Some(Utc::now() - Duration::days(14)))
-        .await?;
-    let url = remote_url.join("/garmin/garmin_connect_activities_db")?;
-    let db_activities: Vec<GarminConnectActivity> = client
-        .get(url)
-        .send()
-        .await?
-        .error_for_status()?
-        .json()
-        .await?;
-    let db_set: HashSet<i64> = db_activities.iter().map(|a| a.activity_id).collect();
+    let ((), connect_activities, db_set) = try_join!(
+        post_heartrate_updates(&client, remote_url, heartrate_updates),
+        connect.get_activities(Some(Utc::now() - Duration::days(14))),
+        get_remote_activity_ids(&client, remote_url),
+    )?;
     let new_activities: Vec<_> = connect_activities
         .into_iter()
         .filter(|a| !db_set.contains(&a.activity_id))
         .collect();
     println!("new activities {:?}", new_activities);
     if let Ok(filenames) = connect.get_activity_files(&new_activities).await {
-        if !filenames.is_empty() {
-            for filename in &filenames {
-                let dname = filename
-                    .file_name()
-                    .ok_or_else(|| format_err!("no filename"))?
-                    .to_string_lossy();
-                let fname = filename.to_string_lossy().to_string();
-                let url = remote_url.join("/garmin/upload_file")?;
-                let url = Url::parse_with_params(url.as_str(), &[("filename", dname)])?;
-                let part = Part::bytes(tokio::fs::read(filename).await?).file_name(fname);
-                let form = Form::new().part("file", part);
-                client
-                    .post(url)
-                    .multipart(form)
-                    .send()
-                    .await?
-                    .error_for_status()?;
-            }
-        }
+        upload_activity_files(&client, remote_url, &filenames).await?;
         println!("Processed {:?}", filenames);
     }
     Ok(())
@@ -3,15 +3,17 @@ use base64::{encode_config, URL_SAFE_NO_PAD};
 use chrono::{DateTime, Local, Utc};
 use chrono_tz::Tz;
 use crossbeam_utils::atomic::AtomicCell;
+use flate2::{write::GzEncoder, Compression};
 use futures::future::try_join_all;
 use lazy_static::lazy_static;
 use log::warn;
 use maplit::hashmap;
+use parking_lot::Mutex;
 use rand::{thread_rng, Rng};
 use reqwest::{
     header::HeaderMap,
     multipart::{Form, Part},
-    Client, Url,
+    Body, Client, StatusCode, Url,
 };
 use rweb::Schema;
 use select::{document::Document, predicate::Attr};
@@ -20,16 +22,19 @@ use smallvec::SmallVec;
 use stack_string::StackString;
 use std::{
     collections::HashSet,
+    mem::replace,
     path::{Path, PathBuf},
+    time::{Duration, SystemTime},
 };
-use tempfile::Builder;
 use tokio::{
-    fs::{create_dir_all, File},
-    io::{AsyncBufReadExt, AsyncWriteExt, BufReader},
+    fs::{create_dir_all, metadata, remove_file, rename, File, OpenOptions},
+    io::{AsyncBufReadExt, AsyncReadExt, AsyncWriteExt, BufReader},
+    sync::mpsc::{channel, Sender},
     task::spawn_blocking,
-    time::sleep,
+    time::{sleep, Instant},
 };
-use tokio_stream::StreamExt;
+use tokio_stream::{wrappers::ReceiverStream, StreamExt};
+use tokio_util::io::ReaderStream;
 
 use garmin_lib::{
     common::{
@@ -37,15 +42,65 @@ use garmin_lib::{
         pgpool::PgPool, strava_activity::StravaActivity,
     },
     utils::{
-        garmin_util::gzip_file,
+        garmin_util::{detect_file_type, FILE_HEAD_SIZE},
         iso_8601_datetime::convert_datetime_to_str,
         sport_types::{self, SportTypes},
     },
 };
 
+const ACTIVITIES_PER_PAGE: usize = 100;
+const MAX_CONCURRENT_PAGES: usize = 4;
+const TOKEN_VALIDATION_INTERVAL: i64 = 600;
+const UPLOAD_GZIP_MIN_SIZE: u64 = 256 * 1024;
+const UPLOAD_CHUNK_SIZE: usize = 64 * 1024;
+const UPLOAD_GZIP_LEVEL: u32 = 6;
+const UPLOAD_CHANNEL_SIZE: usize = 4;
+const UPLOAD_STATUS_TIMEOUT: Duration = Duration::from_secs(10);
+const UPLOAD_STATUS_MAX_DELAY: Duration = Duration::from_secs(1);
+
 lazy_static! {
+    static ref STRAVA_CLIENT: Client = Client::builder()
+        .cookie_store(true)
+        .build()
+        .expect("Failed to build client");
     static ref CSRF_TOKEN: AtomicCell<Option<StackString>> = AtomicCell::new(None);
     static ref WEB_CSRF: AtomicCell<Option<WebCsrf>> = AtomicCell::new(None);
+    static ref TOKEN_VALIDATED: Mutex<Option<(StackString, DateTime<Utc>)>> = Mutex::new(None);
+    static ref TOKEN_CACHE: Mutex<Option<(PathBuf, SystemTime, StravaTokens)>> = Mutex::new(None);
+}
+
+#[derive(Clone, Debug, Default, PartialEq)]
+struct StravaTokens {
+    client_id: StackString,
+    client_secret: StackString,
+    access_token: Option<StackString>,
+    refresh_token: Option<StackString>,
+}
+
+impl StravaTokens {
+    async fn read_tokens(tokenfile: &Path) -> Result<Self, Error> {
+        let mut tokens = Self::default();
+        let f = File::open(tokenfile).await?;
+        let mut b = BufReader::new(f);
+        let mut line = String::new();
+        loop {
+            line.clear();
+            if b.read_line(&mut line).await? == 0 {
+                break;
+            }
+            if let Some((key, val)) = line.split_once('=') {
+                let val = val.trim();
+                match key.trim().to_ascii_lowercase().as_str() {
+                    "client_id" => tokens.client_id = val.into(),
+                    "client_secret" => tokens.client_secret = val.into(),
+                    "access_token" => tokens.access_token = Some(val.into()),
+                    "refresh_token" => tokens.refresh_token = Some(val.into()),
+                    _ => {}
+                }
+            }
+        }
+        Ok(tokens)
+    }
 }
 
 #[derive(Clone, Debug)]
@@ -83,41 +138,56 @@ impl StravaClient {
 
     pub async fn with_auth(config: GarminConfig) -> Result<Self, Error> {
         let mut client = Self::from_file(config).await?;
+        if client.token_recently_validated() {
+            return Ok(client);
+        }
         if client.get_strava_athlete().await.is_err() {
             client.refresh_access_token().await?;
             client.to_file().await?;
         }
+        if let Some(access_token) = client.access_token.clone() {
+            *TOKEN_VALIDATED.lock() = Some((access_token, Utc::now()));
+        }
         Ok(client)
     }
 
+    fn token_recently_validated(&self) -> bool {
+        match TOKEN_VALIDATED.lock().as_ref() {
+            Some((token, validated)) => {
+                Some(token) == self.access_token.as_ref()
+                    && (Utc::now() - *validated).num_seconds() < TOKEN_VALIDATION_INTERVAL
+            }
+            None => false,
+        }
+    }
+
     pub async fn from_file(config: GarminConfig) -> Result<Self, Error> {
-        let mut client = Self {
-            config,
-            client: Client::builder().cookie_store(true).build()?,
-            ..Self::default()
-        };
-        let f = File::open(&client.config.strava_tokenfile).await?;
-        let mut b = BufReader::new(f);
-        let mut line = String::new();
-        loop {
-            line.clear();
-            if b.read_line(&mut line).await? == 0 {
-                break;
+        let modified = metadata(&config.strava_tokenfile).await?.modified()?;
+        let cached = match TOKEN_CACHE.lock().as_ref() {
+            Some((path, mtime, tokens))
+                if *path == config.strava_tokenfile && *mtime == modified =>
+            {
+                Some(tokens.clone())
             }
-            let items: SmallVec<[&str; 2]> = line.split('=').take(2).collect();
-            if let Some(key) = items.get(0) {
-                if let Some(val) = items.get(1) {
-                    match key.trim() {
-                        "client_id" => client.client_id = val.trim().into(),
-                        "client_secret" => client.client_secret = val.trim().into(),
-                        "access_token" => client.access_token = Some(val.trim().into()),
-                        "refresh_token" => client.refresh_token = Some(val.trim().into()),
-                        _ => {}
-                    }
-                }
+            _ => None,
+        };
+        let tokens = match cached {
+            Some(tokens) => tokens,
+            None => {
+                let tokens = StravaTokens::read_tokens(&config.strava_tokenfile).await?;
+                *TOKEN_CACHE.lock() =
+                    Some((config.strava_tokenfile.clone(), modified, tokens.clone()));
+                tokens
             }
-        }
-        Ok(client)
+        };
+        Ok(Self {
+            config,
+            client_id: tokens.client_id,
+            client_secret: tokens.client_secret,
+            access_token: tokens.access_token,
+            refresh_token: tokens.refresh_token,
+            client: STRAVA_CLIENT.clone(),
+        })
     }
 
     pub async fn webauth(&self) -> Result<(), Error> {
@@ -250,20 +320,57 @@ impl StravaClient {
     }
 
     pub async fn to_file(&self) -> Result<(), Error> {
-        let mut f = File::create(&self.config.strava_tokenfile).await?;
-        f.write_all(b"[API]\n").await?;
-        f.write_all(format!("client_id = {}\n", self.client_id).as_bytes())
-            .await?;
-        f.write_all(format!("client_secret = {}\n", self.client_secret).as_bytes())
+        let tokens = StravaTokens {
+            client_id: self.client_id.clone(),
+            client_secret: self.client_secret.clone(),
+            access_token: self.access_token.clone(),
+            refresh_token: self.refresh_token.clone(),
+        };
+        let tokenfile = &self.config.strava_tokenfile;
+        let cached_mtime = match TOKEN_CACHE.lock().as_ref() {
+            Some((path, mtime, cached)) if path == tokenfile && *cached == tokens => Some(*mtime),
+            _ => None,
+        };
+        if cached_mtime.is_some()
+            && metadata(tokenfile).await.and_then(|m| m.modified()).ok() == cached_mtime
+        {
+            return Ok(());
+        }
+
+        let mut buf = format!(
+            "[API]\nclient_id = {}\nclient_secret = {}\n",
+            tokens.client_id, tokens.client_secret
+        );
+        if let Some(token) = tokens.access_token.as_ref() {
+            buf.push_str(&format!("access_token = {}\n", token));
+        }
+        if let Some(token) = tokens.refresh_token.as_ref() {
+            buf.push_str(&format!("refresh_token = {}\n", token));
+        }
+        let fname = tokenfile
+            .file_name()
+            .ok_or_else(|| format_err!("Bad tokenfile {:?}", tokenfile))?
+            .to_string_lossy();
+        let tmp_file =
+            tokenfile.with_file_name(format!(".{}.{}.tmp", fname, Self::get_random_string()));
+        let mut f = OpenOptions::new()
+            .write(true)
+            .create_new(true)
+            .mode(0o600)
+            .open(&tmp_file)
             .await?;
-        if let Some(token) = self.access_token.as_ref() {
-            f.write_all(format!("access_token = {}\n", token).as_bytes())
-                .await?;
+        let result = async {
+            f.write_all(buf.as_bytes()).await?;
+            f.sync_all().await?;
+            rename(&tmp_file, tokenfile).await
         }
-        if let Some(token) = self.refresh_token.as_ref() {
-            f.write_all(format!("refresh_token = {}\n", token).as_bytes())
-                .await?;
+        .await;
+        if result.is_err() {
+            remove_file(&tmp_file).await.ok();
         }
+        result?;
+        let modified = metadata(tokenfile).await?.modified()?;
+        *TOKEN_CACHE.lock() = Some((tokenfile.clone(), modified, tokens));
         Ok(())
     }
 
@@ -396,7 +503,8 @@ impl StravaClient {
             .headers(headers)
             .send()
             .await?
-            .error_for_status()?
+            .error_for_status()
+            .map_err(forget_token_validation)?
             .json()
             .await
             .map_err(Into::into)
@@ -408,7 +516,10 @@ impl StravaClient {
         end_date: Option<DateTime<Utc>>,
         page: usize,
     ) -> Result<Vec<StravaActivity>, Error> {
-        let mut params = vec![("page", page.to_string())];
+        let mut params = vec![
+            ("page", page.to_string()),
+            ("per_page", ACTIVITIES_PER_PAGE.to_string()),
+        ];
         if let Some(start_date) = start_date {
             params.push(("after", start_date.timestamp().to_string()));
         }
@@ -430,7 +541,8 @@ impl StravaClient {
             .headers(headers)
             .send()
             .await?
-            .error_for_status()?
+            .error_for_status()
+            .map_err(forget_token_validation)?
             .json()
             .await
             .map_err(Into::into)
@@ -441,17 +553,24 @@ impl StravaClient {
         start_date: Option<DateTime<Utc>>,
         end_date: Option<DateTime<Utc>>,
     ) -> Result<Vec<StravaActivity>, Error> {
-        let mut page = 1;
-        let mut activities = Vec::new();
-        loop {
-            let new_activities = self
-                .get_strava_activities(start_date, end_date, page)
-                .await?;
-            if new_activities.is_empty() {
-                break;
+        // most syncs cover a short range that fits in one page, only fan out
+        // once a page comes back full
+        let mut activities = self.get_strava_activities(start_date, end_date, 1).await?;
+        let mut more_pages = activities.len() >= ACTIVITIES_PER_PAGE;
+        let mut page = 2;
+        while more_pages {
+            let futures = (page..page + MAX_CONCURRENT_PAGES)
+                .map(|page| self.get_strava_activities(start_date, end_date, page));
+            let pages = try_join_all(futures).await?;
+            page += MAX_CONCURRENT_PAGES;
+            for new_activities in pages {
+                let full_page = new_activities.len() >= ACTIVITIES_PER_PAGE;
+                activities.extend(new_activities);
+                if !full_page {
+                    more_pages = false;
+                    break;
+                }
             }
-            page += 1;
-            activities.extend_from_slice(&new_activities);
         }
         Ok(activities)
     }
@@ -516,7 +635,8 @@ impl StravaClient {
             .form(&data)
             .send()
             .await?
-            .error_for_status()?
+            .error_for_status()
+            .map_err(forget_token_validation)?
             .json()
             .await?;
         Ok(resp.id)
@@ -539,42 +659,56 @@ impl StravaClient {
             activity_id: Option<u64>,
         }
 
-        let mut _tempfile: Option<_> = None;
-
         let ext = filepath
             .extension()
-            .ok_or_else(|| format_err!("No extension"))?
-            .to_string_lossy()
-            .to_string();
+            .map(|ext| ext.to_string_lossy().to_string())
+            .unwrap_or_default();
+        let data_type = match ext.as_str() {
+            "gz" => filepath
+                .file_stem()
+                .and_then(|stem| Path::new(stem).extension())
+                .map(|ext| ext.to_string_lossy().to_string())
+                .unwrap_or_default(),
+            _ => ext.clone(),
+        };
 
-        let filename = if &ext == "gz" {
-            filepath.canonicalize()?.to_string_lossy().to_string()
+        let infname = filepath.canonicalize()?;
+        let filename = infname.to_string_lossy().to_string();
+        let head = read_file_head(&infname).await?;
+        let is_gzipped = is_gzip(&head);
+        let data_type = if data_type == "fit" || data_type == "tcx" {
+            data_type
+        } else if is_gzipped {
+            return Err(format_err!("Bad extension {:?}", filepath));
         } else {
-            let tfile = Builder::new().suffix(&format!(".{}.gz", ext)).tempfile()?;
-            let infname = filepath.canonicalize()?;
-            let outfpath = tfile.path().to_path_buf();
-            let outfname = outfpath.to_string_lossy().to_string();
-            spawn_blocking(move || gzip_file(&infname, &outfpath)).await??;
-            _tempfile = Some(tfile);
-            outfname
+            match detect_file_type(&head) {
+                Some(t) if t == "fit" || t == "tcx" => t.to_string(),
+                _ => return Err(format_err!("Bad extension {:?}", filepath)),
+            }
         };
-
-        let fext = if filename.ends_with("fit.gz") {
-            "fit.gz"
-        } else if filename.ends_with("tcx.gz") {
-            "tcx.gz"
+        let (part, fext) = if is_gzipped || metadata(&infname).await?.len() < UPLOAD_GZIP_MIN_SIZE {
+            let fext = if is_gzipped {
+                format!("{}.gz", data_type)
+            } else {
+                data_type
+            };
+            let f = File::open(&infname).await?;
+            let length = f.metadata().await?.len();
+            let body = Body::wrap_stream(ReaderStream::new(f));
+            let part = Part::stream_with_length(body, length).file_name(filename);
+            (part, fext)
         } else {
-            return Err(format_err!("Bad extension {}", filename));
+            let part = Part::stream(gzip_stream(infname)).file_name(format!("{}.gz", filename));
+            (part, format!("{}.gz", data_type))
         };
 
-        let part = Part::bytes(tokio::fs::read(&filename).await?).file_name(filename);
         let form = Form::new()
             .part("file", part)
             .text("name", title.to_string())
             .text("description", description.to_string())
             .text("trainer", "false")
             .text("commute", "false")
-            .text("data_type", fext.to_string())
+            .text("data_type", fext)
             .text("external_id", uuid::Uuid::new_v4().to_string());
 
         let headers = self.get_auth_headers()?;
@@ -591,7 +725,8 @@ impl StravaClient {
             .headers(headers.clone())
             .send()
             .await?
-            .error_for_status()?
+            .error_for_status()
+            .map_err(forget_token_validation)?
             .json()
             .await?;
 
@@ -601,21 +736,28 @@ impl StravaClient {
             .as_ref()
             .ok_or_else(|| format_err!("Bad URL"))?
             .join(&format!("api/v3/uploads/{}", result.id))?;
-        for _ in 0..10 {
+        let deadline = Instant::now() + UPLOAD_STATUS_TIMEOUT;
+        let mut delay = Duration::from_millis(100);
+        loop {
             let result: UploadResponse = self
                 .client
                 .get(url.as_str())
                 .headers(headers.clone())
                 .send()
                 .await?
-                .error_for_status()?
+                .error_for_status()
+                .map_err(forget_token_validation)?
                 .json()
                 .await?;
             if result.activity_id.is_some() {
                 break;
             }
             warn!("Upload status {}", result.status);
-            sleep(std::time::Duration::from_secs(2)).await;
+            if Instant::now() + delay > deadline {
+                break;
+            }
+            sleep(delay).await;
+            delay = (delay * 2).min(UPLOAD_STATUS_MAX_DELAY);
         }
 
         let url = format!("https://{}/garmin/strava_sync", self.config.domain).into();
@@ -665,7 +807,8 @@ impl StravaClient {
             .json(&data)
             .send()
             .await?
-            .error_for_status()?;
+            .error_for_status()
+            .map_err(forget_token_validation)?;
         let url = format!("https://{}/garmin/strava_sync", self.config.domain);
         let url = if let Some(start_time) = start_time {
             let start_time = convert_datetime_to_str(start_time);
@@ -740,20 +883,118 @@ pub struct StravaAthlete {
     pub sex: StackString,
 }
 
+/// Gzip `infname` on a blocking thread, handing compressed chunks to the
+/// returned body as they are produced so compression overlaps the upload.
+fn gzip_stream(infname: PathBuf) -> Body {
+    let (tx, rx) = channel(UPLOAD_CHANNEL_SIZE);
+    spawn_blocking(move || {
+        if let Err(e) = gzip_to_channel(&infname, &tx) {
+            tx.blocking_send(Err(e)).ok();
+        }
+    });
+    Body::wrap_stream(ReceiverStream::new(rx))
+}
+
+fn gzip_to_channel(
+    infname: &Path,
+    tx: &Sender<Result<Vec<u8>, std::io::Error>>,
+) -> Result<(), std::io::Error> {
+    use std::io::{Read, Write};
+
+    let mut f = std::fs::File::open(infname)?;
+    let mut gz = GzEncoder::new(
+        Vec::with_capacity(UPLOAD_CHUNK_SIZE),
+        Compression::new(UPLOAD_GZIP_LEVEL),
+    );
+    let mut buf = vec![0_u8; UPLOAD_CHUNK_SIZE];
+    loop {
+        let n = f.read(&mut buf)?;
+        if n == 0 {
+            break;
+        }
+        gz.write_all(&buf[..n])?;
+        if gz.get_ref().len() >= UPLOAD_CHUNK_SIZE {
+            let chunk = replace(gz.get_mut(), Vec::with_capacity(UPLOAD_CHUNK_SIZE));
+            if tx.blocking_send(Ok(chunk)).is_err() {
+                // receiver dropped, the upload has been abandoned
+                return Ok(());
+            }
+        }
+    }
+    tx.blocking_send(Ok(gz.finish()?)).ok();
+    Ok(())
+}
+
+/// Drop the cached token validation when the api rejects the token, so the
+/// next `with_auth` probes it again and refreshes if needed.
+fn forget_token_validation(e: reqwest::Error) -> reqwest::Error {
+    if e.status() == Some(StatusCode::UNAUTHORIZED) {
+        *TOKEN_VALIDATED.lock() = None;
+    }
+    e
+}
+
+/// Read up to `FILE_HEAD_SIZE` bytes from the start of `path`, enough for
+/// both gzip and activity file type detection.
+async fn read_file_head(path: &Path) -> Result<Vec<u8>, Error> {
+    let mut head = Vec::with_capacity(FILE_HEAD_SIZE);
+    File::open(path)
+        .await?
+        .take(FILE_HEAD_SIZE as u64)
+        .read_to_end(&mut head)
+        .await?;
+    Ok(head)
+}
+
+fn is_gzip(head: &[u8]) -> bool {
+    head.starts_with(&[0x1f, 0x8b])
+}
+
 #[cfg(test)]
 mod tests {
     use anyhow::Error;
     use chrono::{DateTime, Utc};
+    use flate2::read::GzDecoder;
     use futures::future::try_join_all;
     use log::debug;
-    use std::collections::HashMap;
+    use std::{collections::HashMap, io::Read, path::Path};
+    use tokio::{sync::mpsc::channel, task::spawn_blocking};
 
     use garmin_lib::{
         common::{garmin_config::GarminConfig, pgpool::PgPool},
         utils::sport_types::SportTypes,
     };
 
-    use crate::strava_client::{StravaActivity, StravaClient};
+    use crate::strava_client::{
+        gzip_to_channel, is_gzip, read_file_head, StravaActivity, StravaClient,
+    };
+
+    #[tokio::test]
+    async fn test_is_gzip_file() -> Result<(), Error> {
+        assert!(is_gzip(
+            &read_file_head(Path::new("../tests/data/test.tcx.gz")).await?
+        ));
+        assert!(!is_gzip(
+            &read_file_head(Path::new("../tests/data/test.tcx")).await?
+        ));
+        Ok(())
+    }
+
+    #[tokio::test]
+    async fn test_gzip_to_channel() -> Result<(), Error> {
+        let fname = Path::new("../tests/data/test.fit");
+        let (tx, mut rx) = channel(4);
+        let handle = spawn_blocking(move || gzip_to_channel(fname, &tx));
+        let mut compressed = Vec::new();
+        while let Some(chunk) = rx.recv().await {
+            compressed.extend_from_slice(&chunk?);
+        }
+        handle.await??;
+        let mut output = Vec::new();
+        GzDecoder::new(compressed.as_slice()).read_to_end(&mut output)?;
+        assert_eq!(output, std::fs::read(fname)?);
+        Ok(())
+    }
 
     #[tokio::test]
     #[ignore]
@@ -1,5 +1,7 @@
 use garmin_lib::utils::{
-    garmin_util::{convert_time_string, convert_xml_local_time_to_utc, titlecase},
+    garmin_util::{
+        convert_time_string, convert_xml_local_time_to_utc, detect_file_type, titlecase,
+    },
     iso_8601_datetime::convert_datetime_to_str,
     plot_graph, plot_opts,
 };
@@ -44,3 +46,18 @@ fn test_titlecase() {
     let input = "running";
     assert_eq!(titlecase(input), "Running");
 }
+
+#[test]
+fn test_detect_file_type() {
+    assert_eq!(
+        detect_file_type(b"\x0e\x10\x00\x00\x00\x00\x00\x00.FIT"),
+        Some("fit")
+    );
+    assert_eq!(detect_file_type(b"<@gArMiN@>"), Some("gmn"));
+    assert_eq!(
+        detect_file_type(b"<?xml version=\"1.0\"?>\n<TrainingCenterDatabase>"),
+        Some("tcx")
+    );
+    assert_eq!(detect_file_type(b"<gpx>"), None);
+    assert_eq!(detect_file_type(b""), None);
+}